@@ -1,19 +1,112 @@
-import requests
-from bs4 import BeautifulSoup
-import time
+import argparse
+import asyncio
 import firebase_admin as fba
 from firebase_admin import firestore
-import json
 from dotenv import load_dotenv
-import googlemaps
 import os
+import sys
+from mapsScheduler import MapsScheduler, GEOCODE_CACHE_JSON
+from requestHospitalData import scrape_hospital_data
+
+HOSPITAL_GEOCODE_TXT = "../resource/hospital_geocode.txt"
+# Destinations per packed string, i.e. per Distance Matrix request in distanceCalc.py
+GEOCODE_CHUNK_SIZE = 10
+CHECKPOINT_EVERY = 20
 
 load_dotenv()  # Load environment variables from.env file
 
-# Initialize Firebase (replace with your key file path)
-cred = fba.credentials.Certificate("../resource/mchacks-39f08-firebase-adminsdk-fbsvc-e9f2462832.json")
-app = fba.initialize_app(cred)
+google_api_key = os.getenv("GOOGLE_MAP_PLATFORM_API_KEY")
+
+
+def pack_geocode(location: tuple) -> str:
+    return f"{location[0]}%2C{location[1]}%7C"
+
+
+async def geocode_addresses(addresses: list, concurrency: int, checkpoint_path: str, checkpoint_every: int) -> dict:
+    # The checkpoint is the scheduler's geocode cache, so a resumed run skips
+    # finished addresses and the update cycle picks it up before each run,
+    # filling in Lat/Lng for hospitals it could not geocode until now
+    maps_scheduler = MapsScheduler(google_api_key, workers=concurrency, cache_path=checkpoint_path)
+    await maps_scheduler.start()
+    pending = [address for address in addresses if address not in maps_scheduler.geocode_cache]
+    print(f"{len(addresses) - len(pending)} addresses already geocoded, {len(pending)} remaining.")
+
+    done = 0
+
+    async def geocode(address):
+        nonlocal done
+        await maps_scheduler.geocode(address)
+        done += 1
+        if done % checkpoint_every == 0:
+            maps_scheduler.save_cache()
+            print(f"Geocoded {done}/{len(pending)} addresses. Checkpoint saved.")
+
+    try:
+        await asyncio.gather(*(geocode(address) for address in pending))
+    finally:
+        # Also runs on interruption, so finished geocodes are kept
+        await maps_scheduler.stop()
+    return maps_scheduler.geocode_cache
+
+
+def geocode_document(packed: list) -> dict:
+    # Full string plus one field per chunk; set() without merge so chunks left
+    # over from a longer list are dropped
+    document = {"hospital_geocode_unity": "".join(packed)}
+    for i, start in enumerate(range(0, len(packed), GEOCODE_CHUNK_SIZE)):
+        document[f"hospital_geocode_unity{i}"] = "".join(packed[start:start + GEOCODE_CHUNK_SIZE])
+    return document
+
+
+def build_geocode_document(hospitals: list, locations: dict) -> dict:
+    # distanceCalc.py maps element j of chunk i to hospitals[i * 10 + j], so a gap
+    # would shift every later hospital; refuse instead of packing a partial list
+    missing = [hospital.get('name', hospital.get('address')) for hospital in hospitals
+               if hospital.get('address') not in locations]
+    if missing:
+        raise ValueError(f"No coordinates for {len(missing)} hospitals: {', '.join(map(str, missing))}")
+    return geocode_document([pack_geocode(locations[hospital['address']]) for hospital in hospitals])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Geocode all scraped hospital addresses for the update cycle and distanceCalc.py.")
+    parser.add_argument("--concurrency", type=int, default=4, help="geocoding requests in flight")
+    parser.add_argument("--checkpoint", default=GEOCODE_CACHE_JSON, help="progress file, reused when resuming")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY, help="addresses between checkpoints")
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.checkpoint_every < 1:
+        parser.error("--checkpoint-every must be at least 1")
+
+    # Scrape rather than read hospitalsData, which only lists hospitals that already have coordinates
+    hospitals = [hospital for hospital in scrape_hospital_data() if hospital.get('name') != 'Ensemble du Québec']
+    addresses = list(dict.fromkeys(hospital['address'] for hospital in hospitals
+                                   if hospital.get('address') not in (None, "N/A")))
+    locations = asyncio.run(geocode_addresses(addresses, args.concurrency, args.checkpoint, args.checkpoint_every))
+
+    missing = [address for address in addresses if address not in locations]
+    for address in missing:
+        print(f"No coordinates for {address}, rerun to retry.")
+    print(f"Geocoded {len(addresses) - len(missing)}/{len(addresses)} addresses, "
+          "the next update cycle picks them up from the cache.")
+
+    try:
+        document = build_geocode_document(hospitals, locations)
+    except ValueError as e:
+        print(f"Packed geocode strings not regenerated. {str(e)}")
+        sys.exit(1)
+
+    # Initialize Firebase (replace with your key file path)
+    cred = fba.credentials.Certificate("../resource/mchacks-39f08-firebase-adminsdk-fbsvc-e9f2462832.json")
+    app = fba.initialize_app(cred)
 
-# Initialize Firestore
-db = firestore.client()
+    # Initialize Firestore
+    db = firestore.client()
 
+    # hospitalsData and filteredHospitals belong to the update cycle, so only the
+    # packed strings are written here
+    db.collection("hospital").document("hospitalGeocode").set(document)
+    with open(HOSPITAL_GEOCODE_TXT, "w", encoding="utf-8") as f:
+        f.write(document["hospital_geocode_unity"])
+    print(f"Stored {len(document) - 1} packed geocode strings to firestore database.")
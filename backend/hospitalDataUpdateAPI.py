@@ -1,15 +1,17 @@
 from fastapi import FastAPI, HTTPException, BackgroundTasks
+import asyncio
 import requests
 from bs4 import BeautifulSoup
 import time
 import firebase_admin as fba
 from firebase_admin import firestore
-import googlemaps
 import os
 from dotenv import load_dotenv
 from typing import Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from mapsScheduler import MapsScheduler, PRIORITY_USER, PRIORITY_BACKGROUND
+from hospitalSnapshot import write_snapshot
 
 app = FastAPI()
 scheduler = AsyncIOScheduler()
@@ -20,17 +22,20 @@ load_dotenv()
 # Initialize Firebase (will be initialized in lifespan event)
 firebase_app = None
 db = None
-gmaps = None
+maps_scheduler = None
 
 
 @app.on_event("startup")
 async def startup():
     # Existing initialization code
-    global firebase_app, db, gmaps
+    global firebase_app, db, maps_scheduler
     cred = fba.credentials.Certificate("...")
     firebase_app = fba.initialize_app(cred)
     db = firestore.client()
-    gmaps = googlemaps.Client(key=os.getenv("GOOGLE_MAP_PLATFORM_API_KEY"))
+
+    # All Google Maps traffic goes through the shared, rate-limited scheduler
+    maps_scheduler = MapsScheduler(os.getenv("GOOGLE_MAP_PLATFORM_API_KEY"))
+    await maps_scheduler.start()
 
     # Start scheduler (runs every 5 minutes)
     scheduler.add_job(
@@ -57,11 +62,6 @@ def time_to_minutes(time_str: str) -> float:
 def percentage_to_float(percentage_str: str) -> float:
     return float(str(percentage_str).strip('%')) / 100.0
 
-def transform_geocode(address) -> str:
-    geoloc = gmaps.geocode(address)
-    return (str(geoloc[0]['geometry']['location']['lat']) + "%2C"
-            + str(geoloc[0]['geometry']['location']['lng']) + "%7C")
-
 def scrape_hospital_data():
     hospitals = []
 
@@ -125,12 +125,12 @@ def scrape_hospital_data():
 
     return hospitals
 
-async def update_hospital_data():
+async def update_hospital_data(priority: int = PRIORITY_BACKGROUND):
     try:
-        google_api_key = os.getenv("GOOGLE_MAP_PLATFORM_API_KEY")
         user_ref = db.collection("users").document("google-oauth2|100496775126729065378").get()
         user_location = user_ref.to_dict().get('lastLocation')
-        user_loc_str = f"{user_location['latitude']}%2C{user_location['longitude']}%7C"
+        user_loc = (user_location['latitude'], user_location['longitude'])
+        await maps_scheduler.reload_cache()
 
         data = scrape_hospital_data()
 
@@ -138,15 +138,22 @@ async def update_hospital_data():
             if hospital.get('name') == 'Ensemble du Québec':
                 data.remove(hospital)
 
-        for hospital in data:
-            hospital_address = transform_geocode(hospital['address'])
-            hospital['Lat'] = gmaps.geocode(hospital['address'])[0]['geometry']['location']['lat']
-            hospital['Lng'] = gmaps.geocode(hospital['address'])[0]['geometry']['location']['lng']
-            distance_result = requests.get(
-                f"https://maps.googleapis.com/maps/api/distancematrix/json?origins={user_loc_str}&destinations={hospital_address}&key={google_api_key}")
-            distance = distance_result.json().get('rows', [{}])[0].get('elements', [{}])[0].get('duration', {}).get(
-                'value')
-            hospital['travel_time'] = distance
+        locations = await asyncio.gather(
+            *(maps_scheduler.geocode(hospital['address'], priority) for hospital in data))
+        located = []
+        for hospital, location in zip(data, locations):
+            if location is None:
+                print(f"Skipping {hospital.get('name')}: no coordinates available")
+                continue
+            hospital['Lat'], hospital['Lng'] = location
+            located.append(hospital)
+        data = located
+
+        travel_times = await asyncio.gather(
+            *(maps_scheduler.travel_time(user_loc, (hospital['Lat'], hospital['Lng']), priority) for hospital in data))
+        for hospital, (travel_time, estimated) in zip(data, travel_times):
+            hospital['travel_time'] = travel_time
+            hospital['travel_time_estimated'] = estimated
             if hospital['estimated_waiting_time'] != "currently not available":
                 wait_time = (int(hospital['estimated_waiting_time'].split(':')[0]) * 3600 +
                              int(hospital['estimated_waiting_time'].split(':')[1]) * 60)
@@ -223,6 +230,12 @@ async def update_hospital_data():
         db.collection("hospital").document("hospitalsData").set({"hospitals": hospitals_data})
         print(f"Converted all times to minutes. Data saved to firestore database.")
 
+        # The snapshot is a secondary copy, so failing to write it must not fail the cycle
+        try:
+            await asyncio.to_thread(write_snapshot, hospitals)
+        except OSError as e:
+            print(f"Error writing hospital snapshot: {str(e)}")
+
         return {"message": "Hospital data updated successfully"}
     except Exception as e:
         print(f"Error updating hospital data: {str(e)}")
@@ -232,7 +245,7 @@ async def update_hospital_data():
 @app.post("/update-hospitals")
 async def trigger_hospital_update(background_tasks: BackgroundTasks):
     try:
-        background_tasks.add_task(update_hospital_data)
+        background_tasks.add_task(update_hospital_data, PRIORITY_USER)
         return {"message": "Hospital data update initiated"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -240,10 +253,11 @@ async def trigger_hospital_update(background_tasks: BackgroundTasks):
 @app.on_event("shutdown")
 async def shutdown():
     scheduler.shutdown()
+    await maps_scheduler.stop()
 
 @app.post("/update-hospitals")
 async def manual_update(background_tasks: BackgroundTasks):
-    background_tasks.add_task(update_hospital_data)
+    background_tasks.add_task(update_hospital_data, PRIORITY_USER)
     return {"message": "Manual update triggered"}
 
 if __name__ == "__main__":
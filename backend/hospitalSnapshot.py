@@ -0,0 +1,141 @@
+import mmap
+import os
+import struct
+import sys
+import time
+
+SNAPSHOT_PATH = "../resource/hospital_snapshot.bin"
+
+# File layout (little-endian):
+#   header     magic, format version, column count, row count, created (unix ms)
+#   directory  one entry per column: name, kind, absolute offset, byte length
+#   data       one 8-byte aligned block per column
+#                float64 column: row count doubles, missing values are NaN
+#                utf8 column:    row count + 1 uint32 offsets, then the encoded text
+MAGIC = b"RSNP"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHHIQ")
+DIRECTORY_ENTRY = struct.Struct("<32sB3xQQ")
+OFFSET = struct.Struct("<I")
+KIND_FLOAT64 = 0
+KIND_UTF8 = 1
+
+TEXT_COLUMNS = ["name", "address"]
+FLOAT_COLUMNS = [
+    "Lat", "Lng",
+    "travel_time", "total_waiting_time", "estimated_waiting_time",
+    "waiting_count", "total_people", "stretcher_occupancy",
+    "avg_waiting_room_time", "avg_stretcher_time",
+    "triage_level_1", "triage_level_2", "triage_level_3", "triage_level_4", "triage_level_5",
+]
+
+
+def to_float(value) -> float:
+    if isinstance(value, str) and value.endswith('%'):
+        return float(value.strip('%')) / 100.0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def align(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def write_snapshot(hospitals: list, path: str = SNAPSHOT_PATH):
+    n_rows = len(hospitals)
+    blocks = []
+    for column in TEXT_COLUMNS:
+        encoded = [str(hospital.get(column, "")).encode("utf-8") for hospital in hospitals]
+        offsets = [0]
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        blocks.append((column, KIND_UTF8, struct.pack(f"<{n_rows + 1}I", *offsets) + b"".join(encoded)))
+    for column in FLOAT_COLUMNS:
+        values = [to_float(hospital.get(column)) for hospital in hospitals]
+        blocks.append((column, KIND_FLOAT64, struct.pack(f"<{n_rows}d", *values)))
+
+    directory = []
+    offset = align(HEADER.size + DIRECTORY_ENTRY.size * len(blocks))
+    for column, kind, data in blocks:
+        directory.append(DIRECTORY_ENTRY.pack(column.encode("ascii"), kind, offset, len(data)))
+        offset = align(offset + len(data))
+
+    # Write next to the target and swap in, so readers never map a partial file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(blocks), n_rows, int(time.time() * 1000)))
+        f.write(b"".join(directory))
+        for _, _, data in blocks:
+            f.seek(align(f.tell()))
+            f.write(data)
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+    print(f"Wrote snapshot of {n_rows} hospitals to {path}.")
+
+
+class HospitalSnapshot:
+    """Read-only, memory-mapped view of a snapshot written by write_snapshot.
+
+    Float columns are returned as memoryviews over the mapping, so nothing is
+    copied and worker processes mapping the same file share its pages. Views,
+    and slices taken from them, stay valid after close(); the mapping is
+    unmapped once the last of them is released or garbage collected.
+    """
+
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        # Columns are exposed with the host's byte order and the file is little-endian
+        if sys.byteorder != "little":
+            raise RuntimeError("Hospital snapshots can only be read on little-endian hosts")
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, n_cols, self.n_rows, self.created = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a hospital snapshot")
+        if self.version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {self.version}")
+
+        self.directory = {}
+        for i in range(n_cols):
+            name, kind, offset, length = DIRECTORY_ENTRY.unpack_from(self.buffer, HEADER.size + i * DIRECTORY_ENTRY.size)
+            self.directory[name.rstrip(b"\0").decode("ascii")] = (kind, offset, length)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def columns(self) -> list:
+        return list(self.directory)
+
+    def column(self, name: str) -> memoryview:
+        kind, offset, length = self.directory[name]
+        if kind != KIND_FLOAT64:
+            raise TypeError(f"Column {name} is not numeric, use text() instead")
+        return memoryview(self.buffer)[offset:offset + length].cast('d')
+
+    def text(self, name: str, row: int) -> str:
+        kind, offset, _ = self.directory[name]
+        if kind != KIND_UTF8:
+            raise TypeError(f"Column {name} is not text, use column() instead")
+        start, = OFFSET.unpack_from(self.buffer, offset + row * OFFSET.size)
+        end, = OFFSET.unpack_from(self.buffer, offset + (row + 1) * OFFSET.size)
+        data_start = offset + (self.n_rows + 1) * OFFSET.size
+        return self.buffer[data_start + start:data_start + end].decode("utf-8")
+
+    def close(self):
+        if self.buffer is None:
+            return
+        try:
+            self.buffer.close()
+        except BufferError:
+            # A caller still holds a view into the mapping; dropping our reference
+            # leaves the unmap to garbage collection once the last view goes away
+            pass
+        self.buffer = None
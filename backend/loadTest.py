@@ -0,0 +1,406 @@
+import argparse
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+
+import hospitalDataUpdateAPI as api
+from hospitalSnapshot import write_snapshot
+from mapsScheduler import MapsScheduler, API_LIMITS, GEOCODE_URL, PRIORITY_BACKGROUND, estimate_travel_time
+
+BASELINE_JSON = "../resource/loadtest_baseline.json"
+
+# Weighted mix of what mobile clients send. The service only exposes the update
+# trigger today; read endpoints get added here as they land. By default triggers
+# arriving while a triggered cycle runs are coalesced into it (see
+# install_stand_ins), so the scheduled refresh can finish during a run.
+REQUEST_MIX = [
+    (1.0, "POST", "/update-hospitals"),
+]
+
+# Population centres used to place synthetic users: (lat, lng, weight)
+QUEBEC_CITIES = [
+    (45.5017, -73.5673, 0.50),  # Montréal
+    (46.8139, -71.2080, 0.20),  # Québec
+    (45.4765, -75.7013, 0.08),  # Gatineau
+    (45.4042, -71.8929, 0.07),  # Sherbrooke
+    (48.4284, -71.0537, 0.05),  # Saguenay
+    (46.3430, -72.5430, 0.05),  # Trois-Rivières
+    (48.4490, -68.5230, 0.05),  # Rimouski
+]
+
+# Stand-in latencies in seconds
+MAPS_LATENCY = (0.02, 0.08)
+SCRAPE_PAGE_DELAY = 0.05
+SYNTHETIC_HOSPITALS = 120
+
+# Production rate limits with a quota that a run cannot exhaust, so the normal
+# lookup path is measured rather than the quota fallback
+LOAD_TEST_DAILY_QUOTA = 10 ** 9
+
+# A run regresses when a percentile grows or throughput drops by more than this
+REGRESSION_TOLERANCE = 0.2
+# Rows with fewer completed samples than this are too noisy to compare
+MIN_COMPARE_SAMPLES = 3
+
+# The real cycle; refresh_loop always runs it, whatever the trigger endpoint calls
+update_cycle = api.update_hospital_data
+# Cycles running on the server loop, scheduled or triggered
+cycles_in_flight = 0
+
+
+def random_location() -> dict:
+    lat, lng, _ = random.choices(QUEBEC_CITIES, weights=[city[2] for city in QUEBEC_CITIES])[0]
+    return {"latitude": lat + random.gauss(0, 0.05), "longitude": lng + random.gauss(0, 0.05)}
+
+
+def address_location(address: str) -> tuple:
+    # Stable coordinates per address, clustered around the same cities as users
+    seed = int(hashlib.sha1(address.encode("utf-8")).hexdigest(), 16)
+    lat, lng, _ = QUEBEC_CITIES[seed % len(QUEBEC_CITIES)]
+    return lat + (seed % 1000 - 500) / 5000.0, lng + (seed // 1000 % 1000 - 500) / 5000.0
+
+
+def synthetic_address(i: int) -> str:
+    return f"{i} Synthetic Street, QC"
+
+
+def synthetic_time(rng: random.Random) -> str:
+    return f"{rng.randint(0, 6)}:{rng.randint(0, 59):02d}"
+
+
+def scrape_stand_in():
+    rng = random.Random(0)
+    hospitals = []
+    for i in range(SYNTHETIC_HOSPITALS):
+        hospitals.append({
+            "name": f"Hospital {i}",
+            "address": synthetic_address(i),
+            "estimated_waiting_time": synthetic_time(rng) if rng.random() > 0.1 else api.NOT_AVAILABLE,
+            "waiting_count": str(rng.randint(0, 40)),
+            "total_people": str(rng.randint(40, 120)),
+            "stretcher_occupancy": f"{rng.randint(40, 180)}%",
+            "avg_waiting_room_time": synthetic_time(rng),
+            "avg_stretcher_time": synthetic_time(rng),
+        })
+    # The real scraper blocks the event loop between pages; keep that behaviour
+    for _ in range(12):
+        time.sleep(SCRAPE_PAGE_DELAY)
+    return hospitals
+
+
+class StandInDocument:
+    def __init__(self, store: dict, path: str):
+        self.store = store
+        self.path = path
+
+    def get(self):
+        return self
+
+    def to_dict(self):
+        if self.path.startswith("users/"):
+            return {"lastLocation": random_location()}
+        return copy.deepcopy(self.store.get(self.path))
+
+    def set(self, data: dict):
+        self.store[self.path] = copy.deepcopy(data)
+
+
+class StandInCollection:
+    def __init__(self, store: dict, name: str):
+        self.store = store
+        self.name = name
+
+    def document(self, name: str):
+        return StandInDocument(self.store, f"{self.name}/{name}")
+
+
+class StandInFirestore:
+    def __init__(self):
+        self.store = {}
+
+    def collection(self, name: str):
+        return StandInCollection(self.store, name)
+
+
+class StandInResponse:
+    def __init__(self, data: dict):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class StandInMapsSession:
+    def get(self, url, params=None, timeout=None):
+        time.sleep(random.uniform(*MAPS_LATENCY))
+        if url == GEOCODE_URL:
+            lat, lng = address_location(params["address"])
+            return StandInResponse({"status": "OK", "results": [{"geometry": {"location": {"lat": lat, "lng": lng}}}]})
+        origin = tuple(map(float, params["origins"].split(",")))
+        destination = tuple(map(float, params["destinations"].split(",")))
+        duration = estimate_travel_time(origin, destination)
+        return StandInResponse({"rows": [{"elements": [{"status": "OK", "duration": {"value": duration}}]}]})
+
+    def close(self):
+        pass
+
+
+def install_stand_ins(snapshot_dir: str, maps_qps: float, concurrent_triggers: bool):
+    """Point the app at in-process stand-ins instead of Firebase, Google Maps and quebec.ca."""
+    limits = {name: {**limit, "qps": maps_qps, "daily_quota": LOAD_TEST_DAILY_QUOTA}
+              for name, limit in API_LIMITS.items()}
+
+    async def startup():
+        api.db = StandInFirestore()
+        api.maps_scheduler = MapsScheduler("load-test", limits=limits, cache_path=None, quota_path=None)
+        await api.maps_scheduler.start()
+        api.maps_scheduler.session = StandInMapsSession()
+        # Addresses are already geocoded in production by the addLagLng.py backfill
+        api.maps_scheduler.geocode_cache.update(
+            {synthetic_address(i): address_location(synthetic_address(i)) for i in range(SYNTHETIC_HOSPITALS)})
+
+    async def single_flight_update(priority: int = PRIORITY_BACKGROUND):
+        # A trigger only starts a cycle when none is running, scheduled or
+        # triggered; otherwise the running cycle already serves it
+        if cycles_in_flight:
+            return
+        return await tracked_cycle(priority)
+
+    async def shutdown():
+        await api.maps_scheduler.stop()
+
+    api.app.router.on_startup = [startup]
+    api.app.router.on_shutdown = [shutdown]
+    api.scrape_hospital_data = scrape_stand_in
+    if not concurrent_triggers:
+        api.update_hospital_data = single_flight_update
+    api.write_snapshot = lambda hospitals: write_snapshot(hospitals, os.path.join(snapshot_dir, "hospital_snapshot.bin"))
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class DropShutdownCancellations(logging.Filter):
+    # Triggered refreshes cancelled by the graceful shutdown timeout are expected
+    def filter(self, record):
+        return not (record.exc_info and isinstance(record.exc_info[1], asyncio.CancelledError))
+
+
+def summarize(samples: list, duration: float) -> dict:
+    # Each sample is (start, seconds, outcome) with outcome "ok", "error" or "timeout".
+    # Timed-out samples have no real duration, so only completed ones feed the
+    # throughput, error rate and percentiles.
+    completed = [sample for sample in samples if sample[2] != "timeout"]
+    latencies = [latency for _, latency, _ in completed]
+    errors = sum(1 for _, _, outcome in completed if outcome == "error")
+    return {
+        "requests": len(samples),
+        "completed": len(completed),
+        "throughput_rps": len(completed) / duration if duration else 0.0,
+        "error_rate": errors / len(completed) if completed else 0.0,
+        "timeouts": len(samples) - len(completed),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def virtual_client(client: httpx.AsyncClient, deadline: float, think_time: float, samples: dict):
+    weights = [entry[0] for entry in REQUEST_MIX]
+    while time.monotonic() < deadline:
+        _, method, path = random.choices(REQUEST_MIX, weights=weights)[0]
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path)
+            outcome = "ok" if response.status_code < 400 else "error"
+        except httpx.TimeoutException:
+            outcome = "timeout"
+        except httpx.HTTPError:
+            outcome = "error"
+        samples.setdefault(f"{method} {path}", []).append((start, time.perf_counter() - start, outcome))
+        pause = random.expovariate(1 / think_time) if think_time > 0 else 0
+        await asyncio.sleep(min(pause, max(deadline - time.monotonic(), 0)))
+
+
+async def tracked_cycle(priority: int = PRIORITY_BACKGROUND):
+    global cycles_in_flight
+    cycles_in_flight += 1
+    try:
+        return await update_cycle(priority)
+    finally:
+        cycles_in_flight -= 1
+
+
+async def refresh_loop(deadline: float, interval: float, samples: list):
+    # Mirrors the scheduled refresh so requests are measured while a cycle runs.
+    # Runs on the server's event loop, like the APScheduler job it stands in for.
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(tracked_cycle(), timeout=max(deadline - time.monotonic(), 0))
+            outcome = "ok"
+        except asyncio.TimeoutError:
+            # Still running when the run ended; its elapsed time is a lower bound
+            outcome = "timeout"
+        except Exception:
+            outcome = "error"
+        samples.append((start, time.perf_counter() - start, outcome))
+        await asyncio.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+
+
+def start_server(port: int) -> tuple:
+    # The app gets its own thread and event loop, so blocking in the system under
+    # test stalls the server and not the clients measuring it. Triggered refreshes
+    # still running at the end are abandoned rather than awaited.
+    config = uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning", timeout_graceful_shutdown=1)
+    server = uvicorn.Server(config)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_until_complete, args=(server.serve(),), daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Server failed to start")
+        time.sleep(0.05)
+    return server, loop, thread
+
+
+async def run_load(clients: int, duration: float, think_time: float, refresh_interval: float, port: int) -> dict:
+    server, server_loop, server_thread = start_server(port)
+
+    samples = {}
+    refresh_samples = []
+    # Mobile clients reconnect between sporadic requests instead of holding keep-alive connections
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=0)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+            start = time.monotonic()
+            deadline = start + duration
+            tasks = [virtual_client(client, deadline, think_time, samples) for _ in range(clients)]
+            if refresh_interval > 0:
+                refresh = asyncio.run_coroutine_threadsafe(
+                    refresh_loop(deadline, refresh_interval, refresh_samples), server_loop)
+                tasks.append(asyncio.wrap_future(refresh))
+            await asyncio.gather(*tasks)
+            elapsed = time.monotonic() - start
+    finally:
+        server.should_exit = True
+        await asyncio.to_thread(server_thread.join)
+        server_loop.close()
+
+    report = {
+        "endpoints": {name: summarize(endpoint_samples, elapsed) for name, endpoint_samples in samples.items()},
+    }
+    if refresh_samples:
+        report["refresh"] = summarize(refresh_samples, elapsed)
+    return report
+
+
+def report_rows(report: dict) -> dict:
+    rows = dict(report.get("endpoints", {}))
+    if "refresh" in report:
+        rows["refresh cycle"] = report["refresh"]
+    return rows
+
+
+def compare(report: dict, baseline: dict, tolerance: float = REGRESSION_TOLERANCE) -> list:
+    # Runs with different load settings are not comparable
+    if report.get("config") != baseline.get("config"):
+        raise ValueError(f"Run config {report.get('config')} differs from baseline config {baseline.get('config')}")
+
+    regressions = []
+    baseline_rows = report_rows(baseline)
+    for name, current in report_rows(report).items():
+        previous = baseline_rows.get(name)
+        if previous is None:
+            print(f"{name}: no baseline")
+            continue
+        print(f"{name} timeouts: {previous['timeouts']} -> {current['timeouts']}")
+        if min(current["completed"], previous["completed"]) < MIN_COMPARE_SAMPLES:
+            print(f"{name}: fewer than {MIN_COMPARE_SAMPLES} completed samples, not compared")
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            change = current[metric] / previous[metric] - 1 if previous[metric] else 0.0
+            print(f"{name} {metric}: {previous[metric]:.1f} -> {current[metric]:.1f} ({change:+.0%})")
+            if change > tolerance:
+                regressions.append(f"{name} {metric} up {change:.0%}")
+        change = current["throughput_rps"] / previous["throughput_rps"] - 1 if previous["throughput_rps"] else 0.0
+        print(f"{name} throughput: {previous['throughput_rps']:.1f} -> {current['throughput_rps']:.1f} rps ({change:+.0%})")
+        if change < -tolerance:
+            regressions.append(f"{name} throughput down {-change:.0%}")
+        if current["error_rate"] > previous["error_rate"]:
+            regressions.append(f"{name} error rate {previous['error_rate']:.1%} -> {current['error_rate']:.1%}")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"{'endpoint':<28}{'requests':>10}{'rps':>10}{'errors':>10}{'timeouts':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in report_rows(report).items():
+        print(f"{name:<28}{stats['requests']:>10}{stats['throughput_rps']:>10.1f}{stats['error_rate']:>10.1%}"
+              f"{stats['timeouts']:>10}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay mobile client traffic against the hospital update API.")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean seconds between a client's requests")
+    parser.add_argument("--refresh-interval", type=float, default=5.0, help="seconds between refresh cycles, 0 to disable")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--maps-qps", type=float, default=API_LIMITS["distance_matrix"]["qps"],
+                        help="rate limit per Maps API for the stand-in scheduler")
+    parser.add_argument("--concurrent-triggers", action="store_true",
+                        help="let every trigger start its own cycle, as the unguarded endpoint does")
+    parser.add_argument("--baseline", default=BASELINE_JSON, help="report to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    logging.getLogger("uvicorn.error").addFilter(DropShutdownCancellations())
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        install_stand_ins(snapshot_dir, args.maps_qps, args.concurrent_triggers)
+        report = asyncio.run(run_load(args.clients, args.duration, args.think_time, args.refresh_interval, args.port))
+    report["config"] = {"clients": args.clients, "duration": args.duration, "think_time": args.think_time,
+                        "refresh_interval": args.refresh_interval, "maps_qps": args.maps_qps,
+                        "concurrent_triggers": args.concurrent_triggers}
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Saved baseline to {args.baseline}.")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        try:
+            regressions = compare(report, baseline)
+        except ValueError as e:
+            print(f"Not comparing against {args.baseline}: {str(e)}")
+            sys.exit(2)
+        if regressions:
+            print("Performance regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against baseline.")
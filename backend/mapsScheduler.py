@@ -0,0 +1,316 @@
+import asyncio
+import itertools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+try:
+    import fcntl
+except ImportError:  # Windows: quota and cache files are updated without a lock
+    fcntl = None
+
+GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+GEOCODE_CACHE_JSON = "../resource/geocode_cache.json"
+QUOTA_JSON = "../resource/maps_quota.json"
+
+load_dotenv()  # Limits below can be overridden from the .env file
+
+# Lower value is served first
+PRIORITY_USER = 0
+PRIORITY_BACKGROUND = 1
+
+
+def env_limits(api: str, qps: float, burst: int, daily_quota: int, user_reserve: float) -> dict:
+    # e.g. MAPS_DISTANCE_MATRIX_DAILY_QUOTA=40000
+    prefix = f"MAPS_{api.upper()}_"
+    return {
+        "qps": float(os.getenv(prefix + "QPS", qps)),
+        "burst": int(os.getenv(prefix + "BURST", burst)),
+        "daily_quota": int(os.getenv(prefix + "DAILY_QUOTA", daily_quota)),
+        "user_reserve": float(os.getenv(prefix + "USER_RESERVE", user_reserve)),
+    }
+
+
+# Per API: sustained queries per second, burst size, daily quota and the share of
+# the quota kept for user-facing lookups once background traffic has used the rest.
+# Distance Matrix quota is counted in elements (origins x destinations), as billed.
+# The default Distance Matrix quota covers the 5-minute cycle (~120 elements x 288
+# runs a day) plus the user reserve; lower it to the billing cap of the key in use.
+API_LIMITS = {
+    "geocode": env_limits("geocode", qps=10.0, burst=10, daily_quota=2500, user_reserve=0.2),
+    "distance_matrix": env_limits("distance_matrix", qps=10.0, burst=10, daily_quota=45000, user_reserve=0.2),
+}
+
+# Used to estimate travel time when the Distance Matrix quota is exhausted
+AVERAGE_DRIVING_SPEED_KMH = 40.0
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    d_lat = math.radians(lat2 - lat1)
+    d_lng = math.radians(lng2 - lng1)
+    a = (math.sin(d_lat / 2) ** 2
+         + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_lng / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def estimate_travel_time(origin: tuple, destination: tuple) -> int:
+    distance_km = haversine_km(origin[0], origin[1], destination[0], destination[1])
+    return int(distance_km / AVERAGE_DRIVING_SPEED_KMH * 3600)
+
+
+@contextmanager
+def file_lock(path: str):
+    # Serializes read-modify-write of a shared file across processes
+    if path is None or fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_json(path: str, default):
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return default
+
+
+def write_json(path: str, data):
+    # Swap in a complete file so readers never see a partial write
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+def distance_matrix_elements(params: dict) -> int:
+    return len(params["origins"].split("|")) * len(params["destinations"].split("|"))
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class DailyQuota:
+    """Usage of one API for the current day.
+
+    With a path, the count lives in a JSON file keyed by date that every process
+    using the Maps APIs shares, so restarts and one-off scripts are accounted for.
+    """
+
+    def __init__(self, api: str, limit: int, user_reserve: float, path: str = QUOTA_JSON):
+        self.api = api
+        self.limit = limit
+        self.reserved = int(limit * user_reserve)
+        self.path = path
+        self.usage = {"date": date.today().isoformat(), "used": {}}
+        # Workers call this from several threads; the file lock only covers other processes
+        self.lock = threading.Lock()
+
+    def try_consume(self, priority: int, cost: int = 1) -> bool:
+        # Background traffic degrades early so user-facing lookups keep their share
+        limit = self.limit if priority == PRIORITY_USER else self.limit - self.reserved
+        with self.lock, file_lock(self.path):
+            usage = read_json(self.path, self.usage)
+            if usage.get("date") != date.today().isoformat():
+                usage = {"date": date.today().isoformat(), "used": {}}
+            used = usage["used"].get(self.api, 0)
+            if used + cost > limit:
+                return False
+            usage["used"][self.api] = used + cost
+            self.usage = usage
+            if self.path:
+                write_json(self.path, usage)
+        return True
+
+
+class MapsScheduler:
+    """Single entry point for Google Maps traffic.
+
+    Requests are queued per API, served in priority order under a token bucket,
+    sent through one pooled session and counted against a daily quota. Concurrent
+    lookups of the same address or route share one request. When the quota runs
+    out, geocodes fall back to the cache and travel times to the last known value
+    or a straight-line estimate.
+    """
+
+    def __init__(self, api_key: str, limits: dict = None, workers: int = 4,
+                 cache_path: str = GEOCODE_CACHE_JSON, quota_path: str = QUOTA_JSON):
+        self.api_key = api_key
+        self.limits = limits or API_LIMITS
+        self.workers = workers
+        self.cache_path = cache_path
+        self.quota_path = quota_path
+        self.geocode_cache = {}
+        self.travel_time_cache = {}
+        self.inflight = {}
+        self.session = None
+        self.queues = {}
+        self.buckets = {}
+        self.quotas = {}
+        self.tasks = []
+        self.counter = itertools.count()
+
+    async def start(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.limits), pool_maxsize=self.workers)
+        self.session.mount("https://", adapter)
+        self.load_cache()
+
+        for api, limit in self.limits.items():
+            self.queues[api] = asyncio.PriorityQueue()
+            self.buckets[api] = TokenBucket(limit["qps"], limit["burst"])
+            self.quotas[api] = DailyQuota(api, limit["daily_quota"], limit["user_reserve"], self.quota_path)
+            for _ in range(self.workers):
+                self.tasks.append(asyncio.create_task(self.worker(api)))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.save_cache()
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def read_cache(self) -> dict:
+        return {address: tuple(loc) for address, loc in read_json(self.cache_path, {}).items()}
+
+    def load_cache(self):
+        self.geocode_cache.update(self.read_cache())
+
+    async def reload_cache(self):
+        # Picks up geocodes another process (e.g. addLagLng.py) saved since startup
+        self.geocode_cache.update(await asyncio.to_thread(self.read_cache))
+
+    def save_cache(self):
+        if self.cache_path:
+            # Merge with the file so entries saved by other processes are kept
+            with file_lock(self.cache_path):
+                write_json(self.cache_path, {**self.read_cache(), **self.geocode_cache})
+
+    def send(self, api: str, priority: int, cost: int, url: str, params: dict) -> dict:
+        # Quota is only charged for requests that actually go out
+        if not self.quotas[api].try_consume(priority, cost):
+            raise QuotaExceeded(f"Daily quota for {api} reached")
+        response = self.session.get(url, params=params, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    async def worker(self, api: str):
+        queue = self.queues[api]
+        while True:
+            priority, _, cost, url, params, future = await queue.get()
+            try:
+                if not future.cancelled():
+                    await self.buckets[api].acquire()
+                    result = await asyncio.to_thread(self.send, api, priority, cost, url, params)
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                queue.task_done()
+
+    async def request(self, api: str, url: str, params: dict, priority: int = PRIORITY_BACKGROUND) -> dict:
+        cost = distance_matrix_elements(params) if api == "distance_matrix" else 1
+        future = asyncio.get_running_loop().create_future()
+        await self.queues[api].put((priority, next(self.counter), cost, url, {**params, "key": self.api_key}, future))
+        return await future
+
+    async def shared(self, key: tuple, lookup):
+        # Callers asking for the same key while it is in flight wait on one request
+        if key not in self.inflight:
+            task = asyncio.ensure_future(lookup())
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(self.inflight[key])
+
+    async def geocode(self, address: str, priority: int = PRIORITY_BACKGROUND):
+        if address in self.geocode_cache:
+            return self.geocode_cache[address]
+        return await self.shared(("geocode", address), lambda: self.fetch_geocode(address, priority))
+
+    async def fetch_geocode(self, address: str, priority: int):
+        try:
+            result = await self.request("geocode", GEOCODE_URL, {"address": address}, priority)
+        except Exception as e:
+            print(f"Geocoding failed for {address}: {str(e)}")
+            return None
+        if not result.get("results"):
+            print(f"No geocoding result for {address}: {result.get('status')}")
+            return None
+        location = result["results"][0]["geometry"]["location"]
+        self.geocode_cache[address] = (location["lat"], location["lng"])
+        return self.geocode_cache[address]
+
+    async def travel_time(self, origin: tuple, destination: tuple, priority: int = PRIORITY_BACKGROUND) -> tuple:
+        """Return (seconds, estimated); estimated is True for a straight-line guess."""
+        return await self.shared(("travel_time", origin, destination),
+                                 lambda: self.fetch_travel_time(origin, destination, priority))
+
+    async def fetch_travel_time(self, origin: tuple, destination: tuple, priority: int) -> tuple:
+        params = {"origins": f"{origin[0]},{origin[1]}", "destinations": f"{destination[0]},{destination[1]}"}
+        try:
+            result = await self.request("distance_matrix", DISTANCE_MATRIX_URL, params, priority)
+            duration = result.get('rows', [{}])[0].get('elements', [{}])[0].get('duration', {}).get('value')
+        except Exception as e:
+            print(f"Distance Matrix lookup failed, using fallback: {str(e)}")
+            duration = None
+        if duration is None:
+            return self.fallback_travel_time(origin, destination)
+        self.travel_time_cache[(origin, destination)] = duration
+        return duration, False
+
+    def fallback_travel_time(self, origin: tuple, destination: tuple) -> tuple:
+        cached = self.travel_time_cache.get((origin, destination))
+        if cached is not None:
+            return cached, False
+        return estimate_travel_time(origin, destination), True
+
+    def fallback_distance_matrix(self, origins: list, destinations: list) -> dict:
+        # Same shape as a Distance Matrix response, with guessed elements flagged
+        rows = []
+        for origin in origins:
+            elements = []
+            for destination in destinations:
+                duration, estimated = self.fallback_travel_time(origin, destination)
+                elements.append({"status": "OK", "duration": {"value": duration}, "estimated": estimated})
+            rows.append({"elements": elements})
+        return {"status": "OK", "rows": rows}
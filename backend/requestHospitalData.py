@@ -5,8 +5,10 @@ import firebase_admin as fba
 from firebase_admin import firestore
 import json
 from dotenv import load_dotenv
-import googlemaps
 import os
+import asyncio
+from mapsScheduler import MapsScheduler
+from hospitalSnapshot import write_snapshot
 
 BASE_URL = "https://www.quebec.ca/en/health/health-system-and-services/service-organization/quebec-health-system-and-its-services/situation-in-emergency-rooms-in-quebec"
 HEADERS = {
@@ -17,9 +19,7 @@ NOT_APPLICABLE = "not applicable"
 
 load_dotenv()  # Load environment variables from.env file
 
-# Initialize Google Maps API client
 google_api_key = os.getenv("GOOGLE_MAP_PLATFORM_API_KEY")
-gmaps = googlemaps.Client(key=google_api_key)
 
 def calc(i: float, N: float, T: float, O: float, A_prev: float, S_prev: float):
     return 0.75 ** (5.5 - i) * ((i / 5) ** 4 * (90 * N / T + 60 * O + 0.6 * A_prev + 0.4 * S_prev) + 0.35 * A_prev * (i / 5) ** 1.5 + 0.25 * S_prev * (i / 5) ** 2)
@@ -31,11 +31,6 @@ def time_to_minutes(time_str: str) -> float:
 def percentage_to_float(percentage_str: str) -> float:
     return float(str(percentage_str).strip('%')) / 100.0
 
-def transform_geocode(address) -> str:
-    geoloc = gmaps.geocode(address)
-    return (str(geoloc[0]['geometry']['location']['lat']) + "%2C"
-            + str(geoloc[0]['geometry']['location']['lng']) + "%7C")
-
 def scrape_hospital_data():
     hospitals = []
 
@@ -99,6 +94,25 @@ def scrape_hospital_data():
 
     return hospitals
 
+async def locate_hospitals(data, user_loc):
+    maps_scheduler = MapsScheduler(google_api_key)
+    await maps_scheduler.start()
+
+    async def locate(hospital):
+        location = await maps_scheduler.geocode(hospital['address'])
+        if location is None:
+            print(f"Skipping {hospital.get('name')}: no coordinates available")
+            return None
+        hospital['Lat'], hospital['Lng'] = location
+        hospital['travel_time'], hospital['travel_time_estimated'] = await maps_scheduler.travel_time(user_loc, location)
+        return hospital
+
+    try:
+        located = await asyncio.gather(*(locate(hospital) for hospital in data))
+        return [hospital for hospital in located if hospital is not None]
+    finally:
+        await maps_scheduler.stop()
+
 
 if __name__ == "__main__":
     # Initialize Firebase (replace with your key file path)
@@ -111,7 +125,6 @@ if __name__ == "__main__":
     user_ref = db.collection("users").document("google-oauth2|100496775126729065378").get()
     # print(user_ref.to_dict())
     user_location = user_ref.to_dict().get('lastLocation')
-    user_loc_str = f"{user_location['latitude']}%2C{user_location['longitude']}%7C"
 
     data = scrape_hospital_data()
 
@@ -119,17 +132,9 @@ if __name__ == "__main__":
         if hospital.get('name') == 'Ensemble du Québec':
             data.remove(hospital)
 
+    data = asyncio.run(locate_hospitals(data, (user_location['latitude'], user_location['longitude'])))
+
     for hospital in data:
-        hospital_address = transform_geocode(hospital['address'])
-        hospital['Lat'] = gmaps.geocode(hospital['address'])[0]['geometry']['location']['lat']
-        hospital['Lng'] = gmaps.geocode(hospital['address'])[0]['geometry']['location']['lng']
-        # distance_result = gmaps.distance_matrix(user_loc_str, transform_geocode(hospital['address']), mode="driving")
-        distance_result = requests.get(f"https://maps.googleapis.com/maps/api/distancematrix/json?origins={user_loc_str}&destinations={hospital_address}&key={google_api_key}")
-        # print(distance_result.text)
-        distance = distance_result.json().get('rows', [{}])[0].get('elements', [{}])[0].get('duration', {}).get('value')
-        # distance_info = distance_result.text.get('rows', [{}])[0].get('elements', [{}])[0]
-        # print(distance_info)
-        hospital['travel_time'] = distance
         if hospital['estimated_waiting_time'] != "currently not available":
             wait_time = (int(hospital['estimated_waiting_time'].split(':')[0]) * 3600 +
                          int(hospital['estimated_waiting_time'].split(':')[1]) * 60)
@@ -207,4 +212,9 @@ if __name__ == "__main__":
             'estimated_waiting_time') != NOT_AVAILABLE else NOT_AVAILABLE
 
     db.collection("hospital").document("hospitalsData").set({"hospitals": hospitals_data})
-    print(f"Converted all times to minutes. Data saved to firestore database.")
\ No newline at end of file
+    print(f"Converted all times to minutes. Data saved to firestore database.")
+
+    try:
+        write_snapshot(hospitals)
+    except OSError as e:
+        print(f"Error writing hospital snapshot: {str(e)}")
\ No newline at end of file
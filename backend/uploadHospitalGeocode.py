@@ -5,6 +5,7 @@ import firebase_admin as fba
 from firebase_admin import firestore
 import json
 from dotenv import load_dotenv
+from addLagLng import HOSPITAL_GEOCODE_TXT, geocode_document
 
 load_dotenv()  # Load environment variables from .env file
 
@@ -14,7 +15,9 @@ app = fba.initialize_app(cred)
 # Initialize Firestore
 db = firestore.client()
 
-with open("../resource/hospital_geocode.txt", "r", encoding="utf-8") as f:
+with open(HOSPITAL_GEOCODE_TXT, "r", encoding="utf-8") as f:
     data = f.read()
 
-db.collection("hospital").document("hospitalGeocode").set({"hospital_geocode_unity": data})
\ No newline at end of file
+# Regenerate the per-request chunks distanceCalc.py reads along with the full string
+packed = [location + "%7C" for location in data.split("%7C") if location]
+db.collection("hospital").document("hospitalGeocode").set(geocode_document(packed))